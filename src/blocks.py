@@ -61,20 +61,37 @@ class DBlock(nn.Module):
 SN = spectral_norm
 
 
+def upconv(ConvTranspose, in_channels, out_channels, stride):
+    """
+    Returns a transposed convolution that upsamples its input
+    by the factor of `stride` (exactly, along every dimension).
+    It replaces the 'Upsample -> 3x3 convolution' pair
+    """
+    kernel_size = (torch.tensor(stride) + 2).tolist()
+    return ConvTranspose(
+            in_channels, out_channels, kernel_size, stride, 1)
+
+
 class GBlock(nn.Module):
     """
     Generator's block
+
+    deconv      if True, upsampling is done by a transposed convolution
+                instead of `nn.Upsample` followed by the first convolution
     """
-    def __init__(self, type, in_channels, out_channels, stride):
+    def __init__(
+            self, type, in_channels, out_channels, stride, deconv=False):
         super().__init__()
         if type == '2d':
             Conv = nn.Conv2d
             AvgPool = nn.AvgPool2d
             BatchNorm = nn.BatchNorm2d
+            ConvTranspose = nn.ConvTranspose2d
         elif type == '3d':
             Conv = nn.Conv3d
             AvgPool = nn.AvgPool3d
             BatchNorm = nn.BatchNorm3d
+            ConvTranspose = nn.ConvTranspose3d
         else:
             raise TypeError(
                 "__init__(): argument 'type' "
@@ -93,7 +110,11 @@ class GBlock(nn.Module):
         if in_channels != out_channels:
             proj_list += [SN(Conv(in_channels, out_channels, 1))]
         if (torch.tensor(stride) > 1).any():
-            main_list.insert(2, nn.Upsample(scale_factor=stride))
+            if deconv:
+                main_list[2] = SN(upconv(
+                    ConvTranspose, in_channels, out_channels, stride))
+            else:
+                main_list.insert(2, nn.Upsample(scale_factor=stride))
             proj_list.insert(0, nn.Upsample(scale_factor=stride))
         self.proj = nn.Sequential(*proj_list)
         self.main = nn.Sequential(*main_list)
@@ -105,15 +126,22 @@ class GBlock(nn.Module):
 class CGBlock(nn.Module):
     """
     Conditional generator's block
+
+    deconv      if True, upsampling is done by a transposed convolution
+                instead of `nn.Upsample` followed by the first convolution
     """
-    def __init__(self, type, cond_size, in_channels, out_channels, stride):
+    def __init__(
+            self, type, cond_size, in_channels,
+            out_channels, stride, deconv=False):
         super().__init__()
         if type == '2d':
             Conv = nn.Conv2d
             AvgPool = nn.AvgPool2d
+            ConvTranspose = nn.ConvTranspose2d
         elif type == '3d':
             Conv = nn.Conv3d
             AvgPool = nn.AvgPool3d
+            ConvTranspose = nn.ConvTranspose3d
         else:
             raise TypeError (
                 "__init__(): argument 'type' "
@@ -121,9 +149,14 @@ class CGBlock(nn.Module):
             )
         self.bn1 = CBN(type, cond_size, in_channels)
         self.bn2 = CBN(type, cond_size, out_channels)
-        self.conv1 = SN(Conv(in_channels, out_channels, 3, 1, 1))
+        if deconv and (torch.tensor(stride) > 1).any():
+            self.conv1 = SN(upconv(
+                ConvTranspose, in_channels, out_channels, stride))
+            self.upsample = nn.Identity()
+        else:
+            self.conv1 = SN(Conv(in_channels, out_channels, 3, 1, 1))
+            self.upsample = nn.Upsample(scale_factor=stride)
         self.conv2 = SN(Conv(out_channels, out_channels, 3, 1, 1))
-        self.upsample = nn.Upsample(scale_factor=stride)
         self.relu = nn.ReLU(inplace=True)
 
         proj_list = []
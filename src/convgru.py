@@ -87,7 +87,7 @@ class ConvGRU(nn.Module):
 
     def forward(self, X, h_init=None):
         if h_init is None:
-            h_init = X.new(X.size(0), self.C, *X.shape[3:]).fill_(0)
+            h_init = X.new_zeros(X.size(0), self.C, *X.shape[3:])
         if self.seq_first:
             return self._seqFirstCall(X, h_init)
         else:
@@ -134,7 +134,7 @@ class AdvancedConvGRU(nn.Module):
     
     def forward(self, X, h_init=None):
         if h_init is None:
-            h_init = X.new(X.size(0), self._C, *X.shape[3:]).fill_(0)
+            h_init = X.new_zeros(X.size(0), self._C, *X.shape[3:])
         if self.seq_first:
             return self._seqFirstCall(X, h_init)
         else:
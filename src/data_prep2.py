@@ -1,13 +1,150 @@
+import os
 import cv2
 import pickle
+import torch
 import numpy as np
 
 from tqdm import tqdm
 from pathlib import Path
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
 from smart_open import open
 from torch.utils.data import Dataset
 from text_processing2 import TextProcessor
 
+try:
+    import decord
+except ImportError:
+    decord = None
+
+
+# header of the cache files written by `_dump`; bump the version
+# whenever the layout of the cached database changes
+_MAGIC = b'T2VCACHE'
+_VERSION = 2
+# decord and OpenCV count and resize frames differently,
+# so the decoder is recorded in the names of the cache files
+_DECODER = 'cv2' if decord is None else 'decord'
+
+
+def _dump(obj, fp):
+    """
+    Pickles `obj` with protocol 5. The ndarray buffers are written
+    out-of-band, i.e. straight from numpy memory, each prefixed
+    with its length. The pickle stream itself follows them.
+    Everything is preceded by the `_MAGIC` header and `_VERSION`
+    """
+    buffers = []
+    payload = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    fp.write(_MAGIC + _VERSION.to_bytes(2, 'little'))
+    fp.write(len(buffers).to_bytes(8, 'little'))
+    for buf in buffers:
+        view = buf.raw()
+        fp.write(view.nbytes.to_bytes(8, 'little'))
+        fp.write(view)
+    fp.write(payload)
+
+
+def _load(fp):
+    """
+    Reads an object written by `_dump`. Raises `ValueError`
+    if `fp` was written in another format (e.g. by an older version)
+    or is truncated
+    """
+    header = fp.read(len(_MAGIC) + 2)
+    if header != _MAGIC + _VERSION.to_bytes(2, 'little'):
+        raise ValueError('unknown or outdated cache format')
+    buffers = []
+    for _ in range(int.from_bytes(fp.read(8), 'little')):
+        buf = bytearray(int.from_bytes(fp.read(8), 'little'))
+        if fp.readinto(buf) != len(buf):
+            raise ValueError('truncated cache file')
+        buffers.append(buf)
+    return pickle.load(fp, buffers=buffers)
+
+
+def _openFrames(path, mode, shape):
+    """
+    Maps the uint8 video cache at `path`. np.memmap can't map an empty
+    file, so an in-memory array is returned when there are no videos
+    """
+    if shape[0] == 0:
+        if mode == 'w+':
+            open(path, 'wb').close()
+        return np.empty(shape, 'u1')
+    return np.memmap(path, 'u1', mode, shape=shape)
+
+
+def _countFrames(video):
+    """
+    Returns the number of frames in the `video` file, counted
+    by the same library that `_decode` will use for it
+    """
+    if decord is not None:
+        try:
+            return len(decord.VideoReader(str(video)))
+        except decord.DECORDError:
+            return 0
+
+    ViCap = cv2.VideoCapture(str(video))
+    try:
+        return int(ViCap.get(cv2.CAP_PROP_FRAME_COUNT))
+    finally:
+        ViCap.release()
+
+
+def _decode(video, length, stride, shape):
+    """
+    Retrieves every `stride`-th frame (cropped to the `shape` = (H, W))
+    from the `video` file. The maximum number of frames to go through
+    is limited to the `length` value. In addition to the RGB frames,
+    it returns the length of the resulting video - `CNT`
+
+    Decoding is done in batch with decord if it is installed,
+    otherwise frames are read one by one with OpenCV
+    """
+    H, W = shape
+    if decord is not None:
+        try:
+            vr = decord.VideoReader(str(video), width=W, height=H)
+            CNT = min(len(vr), length)
+            if CNT < length:
+                return [], CNT
+            ids = np.arange(0, length, stride)
+            return vr.get_batch(ids).asnumpy(), CNT
+        except decord.DECORDError:
+            return [], 0
+
+    CNT = 0
+    success = True
+    frames = np.empty((-(-length//stride), H, W, 3), 'u1')
+    ViCap = cv2.VideoCapture(str(video))
+    try:
+        while success and (CNT < length):
+            success, image = ViCap.read()
+            if success and not CNT % stride:
+                frame = frames[CNT//stride]
+                cv2.resize(
+                        image, (W, H), dst=frame,
+                        interpolation=cv2.INTER_AREA)
+                cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame)
+            CNT += success
+    finally:
+        ViCap.release()
+    return frames[:-(-CNT//stride)], CNT
+
+
+def _padPack(ids, starts, max_len):
+    """
+    Lays out the concatenated token `ids` of sentences (the i-th one
+    is `ids[starts[i]:starts[i+1]]`) in rows of a zero-padded matrix.
+    The rows are filled at once through a mask of the sentence lengths
+    """
+    lens = np.diff(starts)
+    out = np.zeros((len(lens), max_len), np.int64)
+    out[np.arange(max_len) < lens[:, None]] = ids
+    return out
+
 
 class LabeledVideoDataset(TextProcessor, Dataset):
     def __init__(
@@ -21,49 +158,69 @@ class LabeledVideoDataset(TextProcessor, Dataset):
                 path, cache, mode, 
                 check_spell, min_word_freq, 
                 glove_folder, emb_size, glove_filtration)
-        self._save_db_as = Path(f'{self._path.stem}.db')
+        stem = f'{self._path.stem}.v{_VERSION}.{_DECODER}'
+        self._save_db_as = Path(f'{stem}.db')
+        self._save_video_as = Path(f'{stem}.bin')
         self._video_shape = video_shape
         self._step = step
 
-        if (cache/self._save_db_as).exists():
-            with open(cache/self._save_db_as, 'rb') as fp:
-                self.data = pickle.load(fp)
-                self._i2i = pickle.load(fp)
-        else:
+        if not self._loadDatabase():
             self._i2i = {}
-            self.data = {'major': [], 'minor': []}
+            self.data = {}
 
             self._prepareDatabase()
             print('Caching database to', self._save_db_as)
             with open(cache/self._save_db_as, 'wb') as fp:
-                pickle.dump(self.data, fp, pickle.HIGHEST_PROTOCOL)
-                pickle.dump(self._i2i, fp)
+                text_data = self.data.copy()
+                del text_data['video']
+                _dump(text_data, fp)
+                pickle.dump(self._i2i, fp, protocol=5)
+                pickle.dump(self.data['video'].shape, fp, protocol=5)
             print('Done!')
 
+    def _loadDatabase(self):
+        """
+        Loads the cached database into `self.data` and `self._i2i`.
+        Returns False if the cache is missing, damaged or has a stale format
+        """
+        if not ((self._cache/self._save_db_as).exists()
+                and (self._cache/self._save_video_as).exists()):
+            return False
+        with open(self._cache/self._save_db_as, 'rb') as fp:
+            try:
+                self.data = _load(fp)
+                self._i2i = pickle.load(fp)
+                shape = pickle.load(fp)
+            except (ValueError, EOFError, pickle.UnpicklingError):
+                print('Cache', self._save_db_as, 'is unusable, rebuilding')
+                return False
+        self.data['video'] = _openFrames(
+                self._cache/self._save_video_as, 'c', shape)
+        return True
+
     def __len__(self):
-        return len(self.data['minor'])
+        return len(self.data['video'])
 
     def __getitem__(self, index):
-        lbl, lbl_len, video = self.data['major'][index]
-        obj_vec, act_vec, act_len = self.data['minor'][index]
+        video = torch.from_numpy(self.data['video'][index])
 
         return {'major': 
-                    {'label': lbl,
-                     'lbllen': lbl_len, 
+                    {'label': self.data['label'][index],
+                     'lbllen': self.data['lbllen'][index], 
                      'video': self.transform(video)},
                 'minor': 
-                    {'object': obj_vec,
-                     'action': act_vec,
-                     'actlen': act_len}}
+                    {'object': self.data['object'][index],
+                     'action': self.data['action'][index],
+                     'actlen': self.data['actlen'][index]}}
 
     def getById(self, video_ids):
         """
-        Extracts the samples' data by their video ids
+        Extracts the samples' data by their video ids. Returns a dict
+        with the same keys as `self.data`
         """
-        ids = list(map(self._i2i.get, video_ids))
-        selected_major = np.take(self.data['major'], ids)
-        selected_minor = np.take(self.data['minor'], ids)
-        return np.rec.array(selected_major), np.rec.array(selected_minor)
+        ids = np.fromiter(
+                map(self._i2i.get, video_ids), np.intp, len(video_ids))
+        return {k: v[ids] for k, v in self.data.items()}
 
     def sen2vec(self, sen, mode):
         """
@@ -80,7 +237,7 @@ class LabeledVideoDataset(TextProcessor, Dataset):
         if mode == 'simple':
             return np.array(filling)
 
-        max_len = self._max_len if mode == 'action' else self._act_max_len
+        max_len = self._max_len if mode == 'label' else self._act_max_len
         numerated = np.zeros(max_len, 'int')
         numerated[:len(filling)] = filling
         return numerated
@@ -89,79 +246,129 @@ class LabeledVideoDataset(TextProcessor, Dataset):
         """
         Fetches videos and corresponding text representations to `self.data`
         Prepares `self._i2i` for the later use by the `self.getById` method
+
+        Videos are decoded in parallel by a pool of `os.cpu_count()`
+        processes, while the text part is processed in the main one.
+        The frames are written straight to a memory-mapped file in the cache
         """
         D, H, W, C = self._video_shape
-        new_index, corrupted, mult = 0, 0, []
+        new_index = 0
         folder = self._path.parents[1]/'video'
-        pbar = tqdm(self.df.iterrows(), "Preparing dataset", len(self.df))
-
-        for old_index, sample in pbar:
-            video = folder/f"{sample.id}.webm"
-            ViCap = cv2.VideoCapture(str(video))
-            _D = ViCap.get(cv2.CAP_PROP_FRAME_COUNT)
-            if int(_D) <  D:
-                self.df.drop(old_index, inplace=True)
-                continue
-
-            mult.append(int(_D) // D)
-            frames, CNT = self._extractFrames(ViCap, D*mult[-1])
-            if CNT == D * mult[-1]:
-                frames = np.array(frames, 'f4').transpose(3,0,1,2)
-                frames = frames[:, ::self._step*mult[-1]] / 255
-                self._processSample(frames, sample)
-                self._i2i[sample.id] = new_index
-                new_index += 1
-            else:
-                corrupted += 1
-                mult.pop()
-                self.df.drop(old_index, inplace=True)
+        videos = np.array([folder/f'{i}.webm' for i in self.df.id], 'O')
+
+        with ProcessPoolExecutor(os.cpu_count()) as pool:
+            frame_counts = np.fromiter(
+                    pool.map(_countFrames, videos, chunksize=64),
+                    'i8', len(videos))
+            mask = frame_counts >= D
+            self.df = self.df[mask]
+            videos, mult = videos[mask], frame_counts[mask] // D
+
+            valid = np.zeros(len(videos), bool)
+            shape = (D//self._step, H, W, C)
+            save_as = self._cache/self._save_video_as
+            video_mm = _openFrames(save_as, 'w+', (len(videos), *shape))
+            lengths, strides = D*mult, self._step*mult
+            decoded = pool.map(
+                    _decode, videos, lengths, strides,
+                    repeat((H, W)), chunksize=8)
+            pbar = tqdm(
+                    zip(self.df.id, lengths, decoded),
+                    "Preparing dataset", len(self.df))
+            for i, (video_id, length, (frames, CNT)) in enumerate(pbar):
+                if CNT == length:
+                    # frames are kept as uint8 (D//step, H, W, C) to save
+                    # memory; see `utils.prepare_video` for the conversion
+                    video_mm[new_index] = frames
+                    self._i2i[video_id] = new_index
+                    valid[i] = True
+                    new_index += 1
+        self.df = self.df[valid]
+        corrupted = len(valid) - new_index
         self.df.index = np.arange(len(self.df))
         print('No of corrupted videos:', corrupted)
-        self.data['major'] = np.array(
-                self.data['major'],
-                [('', 'i8', self._max_len), ('', 'i8'),
-                 ('', 'f4', (C, D//self._step, H, W))])
-        self.data['minor'] = np.array(
-                self.data['minor'],
-                [('', 'O'), ('', 'i8', self._act_max_len), ('', 'i8')])
-
-    def _extractFrames(self, ViCap, length):
+        del video_mm
+        # cut off the rows reserved for corrupted videos
+        os.truncate(save_as, new_index * int(np.prod(shape)))
+        self.data['video'] = _openFrames(save_as, 'c', (new_index, *shape))
+        self._processText()
+
+    def _vectorizeColumn(self, column, max_len):
         """
-        Retrieves cropped to the required shape frames from the stream
-        `ViCap`. The maximum number of extracted frames is limited
-        to the `length` value. In addition to the list of frames,
-        it returns the length of the resulting video - `CNT`
+        Converts all the sentences of `column` (a series of token lists)
+        at once to a zero-padded int64 matrix of width `max_len`
         """
-        CNT = 0
-        frames = []
-        success = True
-        while success and (CNT < length):
-            success, image = ViCap.read()
-            if success:
-                image = cv2.resize(
-                        image, self._video_shape[1:-1], 
-                        interpolation=cv2.INTER_AREA)
-                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-                frames += [image]
-                CNT += 1
-
-        ViCap.release()
-        cv2.destroyAllWindows()
-        return frames, CNT
+        starts = np.zeros(len(column)+1, 'i8')
+        np.cumsum(column.map(len).values, out=starts[1:])
+        ids = np.fromiter(
+                (self.t2i[w] for sen in column for w in sen),
+                'i8', starts[-1])
+        return _padPack(ids, starts, max_len)
 
-    def _processSample(self, frames, sample):
+    def _processText(self):
         """
-        Obtains objects, action and the entire sentence (all vectorized)
-        from the corresponding to frames row in `self.df`. Adds the earlier
-        extracted attributes to `self.data`
+        Obtains objects, actions and the entire sentences (all vectorized)
+        for the rows of `self.df`. Puts them to `self.data`
         """
-        lbl, obj, act = sample[1:4]
-        obj_len, act_len = map(len, [obj, act])
-        lbl_len = act_len + obj_len - 1
+        act_len = self.df.template.map(len).values.astype('i8')
+        obj_len = self.df.placeholders.map(len).values.astype('i8')
+
+        self.data['label'] = self._vectorizeColumn(
+                self.df.label, self._max_len)
+        self.data['lbllen'] = act_len + obj_len - 1
+        self.data['object'] = np.empty(len(self.df), 'O')
+        for i, obj in enumerate(self.df.placeholders):
+            self.data['object'][i] = self.sen2vec(obj, self._mode)
+        self.data['action'] = self._vectorizeColumn(
+                self.df.template, self._act_max_len)
+        self.data['actlen'] = act_len
+
+
+def _mapTensors(fn, obj):
+    """
+    Applies `fn` to every tensor nested in dicts, lists and tuples of `obj`
+    """
+    if torch.is_tensor(obj):
+        return fn(obj)
+    if isinstance(obj, dict):
+        return {k: _mapTensors(fn, v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_mapTensors(fn, v) for v in obj)
+    return obj
+
+
+class CUDAPrefetcher:
+    """
+    Iterates over `loader` and transfers the next batch to `device`
+    on a side CUDA stream while the current one is being processed.
+    To overlap the copies with computations, `loader` should be
+    created with `pin_memory=True`
+    """
+    def __init__(self, loader, device):
+        self.loader = loader
+        self.device = torch.device(device)
+        self.stream = torch.cuda.Stream(self.device)
+
+    def __len__(self):
+        return len(self.loader)
 
-        obj_vec = self.sen2vec(obj, self._mode)
-        act_vec = self.sen2vec(act, 'action')
-        lbl_vec = self.sen2vec(lbl, 'label')
+    def __iter__(self):
+        batches = iter(self.loader)
+        next_batch = self._preload(batches)
+        while next_batch is not None:
+            current = torch.cuda.current_stream(self.device)
+            current.wait_stream(self.stream)
+            # the memory was allocated on the side stream, so the caching
+            # allocator must know that the current stream uses it as well
+            _mapTensors(lambda x: x.record_stream(current), next_batch)
+            batch, next_batch = next_batch, self._preload(batches)
+            yield batch
 
-        self.data['minor'].append((obj_vec, act_vec, act_len))
-        self.data['major'].append((lbl_vec, lbl_len, frames))
+    def _preload(self, batches):
+        try:
+            batch = next(batches)
+        except StopIteration:
+            return None
+        with torch.cuda.stream(self.stream):
+            return _mapTensors(
+                    lambda x: x.to(self.device, non_blocking=True), batch)
@@ -5,10 +5,25 @@ import torch.utils.data
 from torch.nn.utils.rnn import pack_padded_sequence, PackedSequence
 from torch.nn.utils import spectral_norm as SN
 from functools import partial
+from contextlib import nullcontext
 from blocks import DBlock, GBlock, CGBlock, PermInvariantLayer
 from convgru import ConvGRU, AdvancedConvGRU
 
 
+def _bf16Supported():
+    """
+    Whether the current GPU can run autocast in bfloat16
+    """
+    return torch.cuda.is_available() and torch.cuda.is_bf16_supported()
+
+
+def _autocast(enabled):
+    """
+    bfloat16 autocast on GPU if `enabled`, a no-op context otherwise
+    """
+    return torch.autocast('cuda', torch.bfloat16) if enabled else nullcontext()
+
+
 class SimpleTextEncoder:
     """
     Embedding of a sentence is obtained as the average
@@ -180,11 +195,16 @@ class SimpleVideoGenerator(nn.Module):
     Args:
         dim_Z           noise dimensionality
         cond_size       condition size
+        deconv          upsample with transposed convolutions
+                        instead of `nn.Upsample` (see `GBlock`)
+        bf16            run the upsampling stack under bfloat16 autocast
+                        (ignored if the GPU doesn't support bfloat16)
     """
     def __init__(
-            self, dim_Z, cond_size=64, 
-            n_colors=3, base_width=128, video_length=16):
+            self, dim_Z, cond_size=64, n_colors=3, base_width=128,
+            video_length=16, deconv=False, bf16=True):
         super().__init__()
+        self.bf16 = bf16 and _bf16Supported()
         self.dim_Z = dim_Z
         self.n_colors = n_colors
         self.vlen = video_length
@@ -193,7 +213,7 @@ class SimpleVideoGenerator(nn.Module):
         self.gru = nn.GRU(
             self.code_size, self.code_size, batch_first=True)
 
-        GB = partial(GBlock, '3d', stride=(1,2,2))
+        GB = partial(GBlock, '3d', stride=(1,2,2), deconv=deconv)
 
         self.main = nn.Sequential(
             GB(self.code_size, base_width*8),
@@ -210,13 +230,18 @@ class SimpleVideoGenerator(nn.Module):
         """
         vlen = vlen if vlen else self.vlen
 
-        code = c.new(len(c), vlen, self.code_size).normal_()
+        code = torch.randn(
+                len(c), vlen, self.code_size, device=c.device, dtype=c.dtype)
         code[..., self.dim_Z:] = c[:, None, :]
 
         H,_ = self.gru(code)
         H = H.permute(0, 2, 1)[..., None, None]
 
-        return self.main(H)
+        # the upsampling stack is memory-bound, so on GPU
+        # it is run in bfloat16 (BatchNorm stays in float32)
+        with _autocast(self.bf16 and H.is_cuda):
+            out = self.main(H)
+        return out.float()
 
 
 class TestVideoGenerator(nn.Module):
@@ -224,11 +249,14 @@ class TestVideoGenerator(nn.Module):
     Args:
         dim_Z           noise dimensionality
         cond_size       condition size
+        bf16            run the generator's blocks under bfloat16 autocast
+                        (ignored if the GPU doesn't support bfloat16)
     """
     def __init__(
             self, dim_Z, cond_size=64, 
-            n_colors=3, base_width=128, video_length=16):
+            n_colors=3, base_width=128, video_length=16, bf16=True):
         super().__init__()
+        self.bf16 = bf16 and _bf16Supported()
         self.dim_Z = dim_Z
         self.n_colors = n_colors
         self.vlen = video_length
@@ -256,23 +284,30 @@ class TestVideoGenerator(nn.Module):
         """
         vlen = vlen if vlen else self.vlen
 
-        code = c.new(len(c), vlen, self.code_size).normal_()
+        code = torch.randn(
+                len(c), vlen, self.code_size, device=c.device, dtype=c.dtype)
         code[..., self.dim_Z:] = c[:, None, :]
 
-        vcon = c.new(len(c), self.code_size).normal_()
+        vcon = torch.randn(
+                len(c), self.code_size, device=c.device, dtype=c.dtype)
         vcon[:, self.dim_Z:] = c
 
         H,_ = self.gru(code)
         H = H.permute(0, 2, 1)[..., None, None]
 
-        H = self.gblock1(H, vcon)
-        H = self.gblock2(H, vcon)
-        H = self.gblock3(H, vcon)
-        H,_ = self.cgru(H)
-        H = self.gblock4(H, vcon)
-        H = self.gblock5(H, vcon)
+        # only the blocks run in bfloat16; the recurrent state
+        # of the ConvGRU is carried in float32 over all the frames
+        bf16 = self.bf16 and H.is_cuda
+        with _autocast(bf16):
+            H = self.gblock1(H, vcon)
+            H = self.gblock2(H, vcon)
+            H = self.gblock3(H, vcon)
+        H,_ = self.cgru(H.float())
+        with _autocast(bf16):
+            H = self.gblock4(H, vcon)
+            H = self.gblock5(H, vcon)
 
-        return torch.tanh(H)
+        return torch.tanh(H.float())
 
 
 class MultiConditionalVideoGenerator(nn.Module):
@@ -318,17 +353,21 @@ class MultiConditionalVideoGenerator(nn.Module):
         vlen = vlen if vlen else self.vlen
 
         # >> basic conditioning
-        code = lc.new(N, vlen//2, self.code_size).normal_()
+        code = torch.randn(
+                N, vlen//2, self.code_size, device=lc.device, dtype=lc.dtype)
         code[..., self.dim_Z:] = lc[:, None, :]
 
         # >> frame-level conditioning
-        imcond = ic.new(N*vlen, self.imcond_size).normal_()
+        imcond = torch.randn(
+                N*vlen, self.imcond_size, device=ic.device, dtype=ic.dtype)
         imcond[:, self.dim_Z:] = ic.repeat_interleave(vlen, 0)
-        hicond = ic.new(N, self.imcond_size).normal_()
+        hicond = torch.randn(
+                N, self.imcond_size, device=ic.device, dtype=ic.dtype)
         hicond[:, self.dim_Z:] = ic
 
         # >> action-capturing conditioning
-        vicond = vc.new(N, self.vicond_size).normal_()
+        vicond = torch.randn(
+                N, self.vicond_size, device=vc.device, dtype=vc.dtype)
         vicond[:, self.dim_Z:] = vc
 
         H,_ = self.gru(code)
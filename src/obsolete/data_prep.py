@@ -8,6 +8,11 @@ from smart_open import open
 from torch.utils.data import Dataset
 from text_processing import doTextPart, sen2vec
 
+try:
+    import decord
+except ImportError:
+    decord = None
+
 
 class LabeledVideoDataset(Dataset):
     def __init__(
@@ -21,6 +26,9 @@ class LabeledVideoDataset(Dataset):
         file_name = path.stem
 
         cache = Path(cache)
+        # decord and OpenCV resize differently, so their caches are kept apart
+        if decord is not None:
+            file_name += '.decord'
         if (cache / f"{file_name}.db").exists():
             with open(cache / f"{file_name}.db", 'rb') as fp:
                 self.data = pickle.load(fp)
@@ -45,35 +53,51 @@ class LabeledVideoDataset(Dataset):
             pbar = tqdm(df.iterrows(), "Preparing dataset", len(df))
             for _, sample in pbar:
                 video = folder / 'video' / f"{sample['id']}.{ext}"
-                ViCap = cv2.VideoCapture(str(video))
-                _D = ViCap.get(cv2.CAP_PROP_FRAME_COUNT)
-
-                if int(_D) <  D :  continue
-                mult.append(int(_D) // D) 
-
-                CNT = 0
-                frames = []
-                success = True
-                while success and (CNT < D * mult[-1]):
-                    success, image = ViCap.read()
-                    if success:
-                        image = cv2.resize(
-                                image, (H, W), 
-                                interpolation=cv2.INTER_AREA)
-                        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-                        frames += [image]
-                        CNT += 1
-
-                ViCap.release()
-                cv2.destroyAllWindows()
+                if decord is not None:
+                    # only the kept frames are decoded, resized in C
+                    try:
+                        vr = decord.VideoReader(
+                                str(video), width=H, height=W)
+                    except decord.DECORDError:
+                        continue
+
+                    if len(vr) <  D :  continue
+                    mult.append(len(vr) // D)
+
+                    CNT = D * mult[-1]
+                    frames = vr.get_batch(
+                            np.arange(0, CNT, step * mult[-1])).asnumpy()
+                else:
+                    ViCap = cv2.VideoCapture(str(video))
+                    try:
+                        _D = ViCap.get(cv2.CAP_PROP_FRAME_COUNT)
+
+                        if int(_D) <  D :  continue
+                        mult.append(int(_D) // D) 
+
+                        CNT = 0
+                        success = True
+                        frames = np.empty((D * mult[-1], W, H, C), 'uint8')
+                        while success and (CNT < D * mult[-1]):
+                            success, image = ViCap.read()
+                            if success:
+                                cv2.resize(
+                                        image, (H, W), dst=frames[CNT],
+                                        interpolation=cv2.INTER_AREA)
+                                cv2.cvtColor(
+                                        frames[CNT], cv2.COLOR_BGR2RGB,
+                                        dst=frames[CNT])
+                                CNT += 1
+                    finally:
+                        ViCap.release()
+                    frames = frames[::step * mult[-1]]
 
                 if CNT == D * mult[-1]:
-                    frames = np.array(
-                        frames, 'float32').transpose(3,0,1,2) / 255
+                    frames = frames.transpose(3,0,1,2).astype('float32')
+                    frames /= 255
                     sen_len = len(sample['label'])
                     numerated = sen2vec(sample['label'], t2i, max_len)
-                    self.data.append(
-                        (sen_len, numerated, frames[:, ::step * mult[-1]]))
+                    self.data.append((sen_len, numerated, frames))
                     self.i2i[sample['id']] = index
                     index += 1
                 else:
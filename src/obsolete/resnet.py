@@ -2,16 +2,29 @@ import torch
 from torch import nn
 
 
+_LAYERS = {
+    '2d': (nn.Conv2d, nn.AvgPool2d, nn.BatchNorm2d),
+    '3d': (nn.Conv3d, nn.AvgPool3d, nn.BatchNorm3d),
+}
+
+
 class Noise(nn.Module):
     def __init__(self, noise, sigma=.1):
         super().__init__()
         self.noise = noise
         self.sigma = sigma
+        self._buf = None
 
     def forward(self, x):
-        if self.noise:
-            return x + self.sigma * torch.randn_like(x)
-        return x
+        if not self.noise:
+            return x
+        # the noise buffer is reallocated only when the input changes
+        # its shape, device or dtype; add's backward does not need it
+        if (self._buf is None or self._buf.shape != x.shape
+                or self._buf.device != x.device
+                or self._buf.dtype != x.dtype):
+            self._buf = torch.empty_like(x)
+        return torch.add(x, self._buf.normal_(), alpha=self.sigma)
 
 
 def block1x1(Conv, BatchNorm, inC, outC, noise, sigma):
@@ -20,7 +33,7 @@ def block1x1(Conv, BatchNorm, inC, outC, noise, sigma):
     (1x1x1 in case of 3d) with subsequent normalization 
     and rectification
     """
-    block_list = [Noise(noise, sigma)]
+    block_list = [Noise(noise, sigma)] if noise else []
     block_list += [Conv(inC, outC, 1, bias=False)]
     if BatchNorm is not None:
         block_list += [BatchNorm(outC)]
@@ -34,7 +47,7 @@ def block3x3(Conv, BatchNorm, inC, outC, stride, noise, sigma):
     (3x3x3 in case of 3d) with subsequent normalization 
     and rectification
     """
-    block_list = [Noise(noise, sigma)]
+    block_list = [Noise(noise, sigma)] if noise else []
     block_list += [Conv(inC, outC, 3, stride, 1, bias=False)]
     if BatchNorm is not None:
         block_list += [BatchNorm(outC)]
@@ -57,19 +70,13 @@ class BasicBlock(nn.Module):
             stride=1, bn=True, noise=False, sigma=.2):
         super().__init__()
 
-        if type == '3d': 
-            Conv = nn.Conv3d
-            AvgPool = nn.AvgPool3d
-            BatchNorm = nn.BatchNorm3d if bn else None
-        elif type == '2d':
-            Conv = nn.Conv2d
-            AvgPool = nn.AvgPool2d
-            BatchNorm = nn.BatchNorm2d if bn else None
-        else:
+        if type not in _LAYERS:
             raise TypeError (
                 "__init__(): argument 'type' "
                 "must be '2d' or '3d'"
             )
+        Conv, AvgPool, BatchNorm = _LAYERS[type]
+        BatchNorm = BatchNorm if bn else None
         proj_list = []
         self.proj = None
         assert (torch.tensor(stride) <= 2).all() 
@@ -114,19 +121,13 @@ class Bottleneck(nn.Module):
             bn=True, width=None, noise=False, sigma=.2):
         super().__init__()
 
-        if type == '3d': 
-            Conv = nn.Conv3d
-            AvgPool = nn.AvgPool3d
-            BatchNorm = nn.BatchNorm3d if bn else None
-        elif type == '2d':
-            Conv = nn.Conv2d
-            AvgPool = nn.AvgPool2d
-            BatchNorm = nn.BatchNorm2d if bn else None
-        else:
+        if type not in _LAYERS:
             raise TypeError (
                 "__init__(): argument 'type' "
                 "must be '2d' or '3d'"
             )
+        Conv, AvgPool, BatchNorm = _LAYERS[type]
+        BatchNorm = BatchNorm if bn else None
         proj_list = []
         self.proj = None
         assert (torch.tensor(stride) <= 2).all() 
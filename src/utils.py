@@ -18,6 +18,17 @@ def to_video(tensor):
     return generated.astype('uint8')
 
 
+def prepare_video(batch, device):
+    """
+    Transfers uint8 videos of shape (N, D, H, W, C) (the layout
+    in which LabeledVideoDataset stores them) to the `device`,
+    and only there converts them to the float tensor
+    of shape (N, C, D, H, W) with values in [0, 1]
+    """
+    batch = batch.to(device, non_blocking=True)
+    return batch.permute(0, 4, 1, 2, 3).float().mul_(1/255.)
+
+
 def selectFramesRandomly(N, k):
     """
     N - total number of frames
@@ -37,10 +48,11 @@ def calc_grad_penalty(real_samples, fake_samples, net_D, condition):
         fake_samples - tensor of the same shape as `real_samples`
         net_D - conditional discriminator
     """
-    alpha = real_samples.new(
+    alpha = torch.rand(
             real_samples.size(0),
-            *([1]*(real_samples.dim()-1))
-            ).uniform_().expand(*real_samples.shape)
+            *([1]*(real_samples.dim()-1)),
+            device=real_samples.device, dtype=real_samples.dtype
+            ).expand(*real_samples.shape)
 
     inputs = alpha * real_samples + (1-alpha) * fake_samples.detach()
     inputs.requires_grad_(True)